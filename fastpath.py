@@ -0,0 +1,546 @@
+############
+# Parser, key-value store and command functions, which run on every request.
+# This module is fully annotated so it can be compiled with mypyc, see the README file.
+############
+
+import heapq
+from collections.abc import Callable
+from typing import cast
+
+# ========== #
+#  Globals   #
+STD_RESPONSE = b'PONG'
+CRLF = b'\r\n'
+SIMPLE_STRING_PREFIX = b'+'
+ERROR_PREFIX = b'-ERR '
+NIL_RESPONSE = b'$-1\r\n'
+
+# Pre-encoded replies for the most common messages
+CANNED_RESPONSES = {
+    b'OK': b'+OK\r\n',
+    STD_RESPONSE: b'+PONG\r\n',
+}
+
+# Spellings of the SET expiry option
+PX_OPTIONS = (b'px', b'PX')
+
+# Maps each key to a (value, expiration time or None) tuple
+KEY_VALUE_STORE: dict[bytes, tuple[bytes, int | None]] = {}
+
+# Min-heap of (expiration time, key) used to actively remove expired keys
+EXPIRY_HEAP: list[tuple[int, bytes]] = []
+
+# Heap entries popped per removeExpiredKeys() call, and heap size below which stale entries are never compacted
+EXPIRY_CYCLE_LIMIT = 1000
+EXPIRY_HEAP_MIN_COMPACT_SIZE = 1024
+
+# Longest header line and largest array accepted from a client, longer ones are rejected as malformed
+MAX_LINE_LENGTH = 64 * 1024
+MAX_ARRAY_LENGTH = 1024
+
+# Returned by parseAll() instead of a byte count when the client sent something that is not properly formatted
+PROTOCOL_ERROR = -1
+
+# ========== #
+#  Parsers   #
+class IncompleteMessageError(Exception):
+    """ Raised by parse() and scan() when the buffer ends before the value does, more bytes have to be read first.
+
+    Attributes:
+        needed (int): length the buffer has to reach before parsing the value again can make progress
+    """
+    def __init__(self, needed: int) -> None:
+        super().__init__(needed)
+        self.needed = needed
+
+
+def findLineEnd(buf: bytes | bytearray, pos: int) -> int:
+    """ Finds the CRLF ending the header line of the value starting at buf[pos].
+    Only looks MAX_LINE_LENGTH bytes ahead, so a client that never sends CRLF is not scanned again and again.
+
+    Args:
+        buf (bytes | bytearray): raw message received from client
+        pos (int): index of the type byte of the value
+
+    Raises:
+        IncompleteMessageError: if buf ends before the header line does
+        ValueError: if the header line is too long
+
+    Returns:
+        int: index of the CRLF
+    """
+    if pos >= len(buf):
+        raise IncompleteMessageError(pos + 1)
+
+    crlf = buf.find(CRLF, pos + 1, pos + MAX_LINE_LENGTH)
+    if crlf == -1:
+        if len(buf) >= pos + MAX_LINE_LENGTH:
+            raise ValueError("header line too long")
+        raise IncompleteMessageError(len(buf) + 1)
+
+    return crlf
+
+
+def parseLength(buf: bytes | bytearray, pos: int, crlf: int) -> int:
+    """ Reads the length from the header line of an array or a bulk string, which is an optional minus sign followed by digits.
+
+    Args:
+        buf (bytes | bytearray): raw message received from client
+        pos (int): index of the type byte
+        crlf (int): index of the CRLF ending the header line
+
+    Raises:
+        ValueError: if the length is not written as an optional minus sign followed by digits
+
+    Returns:
+        int: length read from the header line
+    """
+    digits = buf[pos + 1:crlf]
+    if digits[:1] == b'-':
+        digits = digits[1:]
+
+    # int() alone would also accept whitespace, '+' and '_'
+    if not digits.isdigit():
+        raise ValueError("invalid length")
+
+    return int(buf[pos + 1:crlf])
+
+
+def parseArrayLength(buf: bytes | bytearray, pos: int, crlf: int) -> int:
+    """ Reads the element count from the header line of an array.
+
+    Args:
+        buf (bytes | bytearray): raw message received from client
+        pos (int): index of the type byte of the array
+        crlf (int): index of the CRLF ending the header line
+
+    Raises:
+        ValueError: if the count is malformed or is above MAX_ARRAY_LENGTH
+
+    Returns:
+        int: element count, negative for a nil array
+    """
+    count = parseLength(buf, pos, crlf)
+    if count > MAX_ARRAY_LENGTH:
+        raise ValueError("too many array elements")
+
+    return count
+
+
+def parseString(buf: bytes, pos: int) -> tuple[bytes | None, int]:
+    """ Parses a Redis Protocol simple or bulk string starting at buf[pos].
+
+    Args:
+        buf (bytes): raw message received from client
+        pos (int): index of the type byte of the string to parse
+
+    Raises:
+        IncompleteMessageError: if buf ends before the string is complete
+        ValueError: if message is not properly formatted or is not a string
+
+    Returns:
+        tuple[bytes | None, int]: parsed string (None for a nil bulk string) and the index right after it
+    """
+    # Every value starts with a header line terminated by CRLF
+    crlf = findLineEnd(buf, pos)
+
+    match buf[pos]:
+        case 0x2B:
+            # '+' simple string, the header line is the value
+            return buf[pos + 1:crlf], crlf + 2
+        case 0x24:
+            # '$' bulk string, the header line holds the length
+            length = parseLength(buf, pos, crlf)
+            if length < 0:
+                return None, crlf + 2
+
+            start = crlf + 2
+            end = start + length
+            if len(buf) < end + 2:
+                raise IncompleteMessageError(end + 2)
+            if not buf.startswith(CRLF, end):
+                raise ValueError("bulk string length mismatch")
+
+            return buf[start:end], end + 2
+        case 0x2A:
+            raise ValueError("nested arrays are not supported")
+        case _:
+            raise ValueError("unknown type byte")
+
+
+def parse(buf: bytes, pos: int = 0) -> tuple[object, int]:
+    """ Parses a single Redis Protocol value starting at buf[pos] in one pass over the raw bytes.
+    Supports simple strings, bulk strings and arrays of strings. Arrays are parsed in a flat loop,
+    and nested arrays are rejected since no command takes them.
+
+    Args:
+        buf (bytes): raw message received from client
+        pos (int): index of the type byte of the value to parse
+
+    Raises:
+        IncompleteMessageError: if buf ends before the value is complete
+        ValueError: if message is not properly formatted
+
+    Returns:
+        tuple[object, int]: parsed value and the index right after it
+    """
+    if pos >= len(buf) or buf[pos] != 0x2A:
+        return parseString(buf, pos)
+
+    # '*' array, the header line holds the element count
+    crlf = findLineEnd(buf, pos)
+    count = parseArrayLength(buf, pos, crlf)
+    if count < 0:
+        return None, crlf + 2
+
+    elements: list[object] = []
+    pos = crlf + 2
+    for _ in range(count):
+        element, pos = parseString(buf, pos)
+        elements.append(element)
+
+    return elements, pos
+
+
+def scanString(buf: bytes | bytearray, pos: int) -> int:
+    """ Finds where the simple or bulk string starting at buf[pos] ends without building it.
+
+    Args:
+        buf (bytes | bytearray): raw message received from client
+        pos (int): index of the type byte of the string to scan
+
+    Raises:
+        IncompleteMessageError: if buf ends before the string is complete
+        ValueError: if message is not properly formatted or is not a string
+
+    Returns:
+        int: index right after the string
+    """
+    crlf = findLineEnd(buf, pos)
+
+    match buf[pos]:
+        case 0x2B:
+            return crlf + 2
+        case 0x24:
+            length = parseLength(buf, pos, crlf)
+            end = crlf + 2 + length + 2
+            if length >= 0 and len(buf) < end:
+                raise IncompleteMessageError(end)
+
+            return end if length >= 0 else crlf + 2
+        case 0x2A:
+            raise ValueError("nested arrays are not supported")
+        case _:
+            raise ValueError("unknown type byte")
+
+
+def scan(buf: bytes | bytearray, pos: int = 0) -> int:
+    """ Finds where the value starting at buf[pos] ends without building it.
+    Only headers are read and bulk string contents are skipped, so checking an incomplete command again is cheap.
+    Contents are validated later by parse().
+
+    Args:
+        buf (bytes | bytearray): raw message received from client
+        pos (int): index of the type byte of the value to scan
+
+    Raises:
+        IncompleteMessageError: if buf ends before the value is complete
+        ValueError: if message is not properly formatted
+
+    Returns:
+        int: index right after the value
+    """
+    if pos >= len(buf) or buf[pos] != 0x2A:
+        return scanString(buf, pos)
+
+    crlf = findLineEnd(buf, pos)
+    count = parseArrayLength(buf, pos, crlf)
+    pos = crlf + 2
+    for _ in range(count):
+        pos = scanString(buf, pos)
+
+    return pos
+
+
+def parseAll(buf: bytes | bytearray, resume: bool = False) -> tuple[list[object], int, int]:
+    """ Parses every complete Redis Protocol value in buf, so pipelined commands are parsed in one call.
+    Parsing stops at a value that is not properly formatted, since we cannot tell where the next one starts.
+
+    Args:
+        buf (bytes | bytearray): raw bytes received from client
+        resume (bool): whether buf starts with a value that was incomplete on the previous call,
+            in which case it is scanned first instead of being parsed again while still incomplete
+
+    Returns:
+        tuple[list[object], int, int]: parsed values, the number of bytes consumed and the number of
+            unconsumed bytes needed before parsing the incomplete value left in buf can make progress
+            (0 if there is none, or PROTOCOL_ERROR if the rest of buf is not properly formatted)
+    """
+    messages: list[object] = []
+    pos = 0
+
+    try:
+        if resume:
+            scan(buf)
+
+        # Parsing works on a bytes snapshot, so the parsed keys and values are immutable and hashable
+        snapshot = bytes(buf)
+        while pos < len(snapshot):
+            message, pos = parse(snapshot, pos)
+            messages.append(message)
+    except IncompleteMessageError as error:
+        return messages, pos, error.needed - pos
+    except Exception:
+        # Any other parse failure means the client sent something we cannot make sense of
+        return messages, len(buf), PROTOCOL_ERROR
+
+    return messages, pos, 0
+
+# ================== #
+#  Expiry Functions  #
+def getExpirationTime(milliseconds: bytes, currentTime: int) -> int:
+    """ Helper functions that computes the expiration time for a key. 
+    Only to be called from inside setCommand().
+
+    Args:
+        milliseconds (bytes): time limit in milliseconds, the argument following px
+        currentTime (int): monotonic time in nanoseconds at which the command was received
+
+    Returns:
+        int: monotonic time in nanoseconds at which the key expires
+    """
+    # Get time limit in nanoseconds from the given milliseconds
+    timeLimit = int(milliseconds) * 1_000_000
+
+    return currentTime + timeLimit
+
+def removeExpiredKeys(currentTime: int) -> bool:
+    """ Helper functions that removes keys whose expiration time has passed, at most EXPIRY_CYCLE_LIMIT heap entries per call
+    so a burst of keys sharing a TTL does not stall the event loop. 
+    Heap entries left behind by keys that were overwritten or already removed are skipped.
+
+    Args:
+        currentTime (int): monotonic time in nanoseconds
+
+    Returns:
+        bool: boolean indicating whether expired entries are left for another call
+    """
+    compactExpiryHeap()
+
+    for _ in range(EXPIRY_CYCLE_LIMIT):
+        if not EXPIRY_HEAP or EXPIRY_HEAP[0][0] > currentTime:
+            return False
+
+        expirationTime, key = heapq.heappop(EXPIRY_HEAP)
+
+        # Only remove the key if the heap entry still matches its stored expiry
+        entry = KEY_VALUE_STORE.get(key)
+        if entry is not None and entry[1] == expirationTime:
+            del KEY_VALUE_STORE[key]
+
+    return bool(EXPIRY_HEAP) and EXPIRY_HEAP[0][0] <= currentTime
+
+def compactExpiryHeap() -> None:
+    """ Helper functions that drops stale heap entries once they outnumber the keys in the store.
+    Every SET with PX pushes an entry, so a hot key set over and over leaves one stale entry per SET until its old
+    expiration time passes. Rebuilding only when the heap is twice the store keeps the cost amortised O(1) per SET.
+    """
+    if len(EXPIRY_HEAP) <= 2 * len(KEY_VALUE_STORE) + EXPIRY_HEAP_MIN_COMPACT_SIZE:
+        return
+
+    liveEntries: list[tuple[int, bytes]] = []
+    for expirationTime, key in EXPIRY_HEAP:
+        entry = KEY_VALUE_STORE.get(key)
+        if entry is not None and entry[1] == expirationTime:
+            liveEntries.append((expirationTime, key))
+
+    heapq.heapify(liveEntries)
+    EXPIRY_HEAP[:] = liveEntries
+
+    
+# ========== #
+#  Commands  #
+def pingCommand(arguments: list[bytes], replies: list[bytes], currentTime: int) -> None:
+    """ Auxiliary function that handles PING command
+
+    Args:
+        arguments (list[bytes]): list of arguments
+        replies (list[bytes]): replies to send back to connection that sent command
+        currentTime (int): monotonic time in nanoseconds at which the command was received
+    """
+    appendReply(STD_RESPONSE, replies)
+
+
+def echoCommand(arguments: list[bytes], replies: list[bytes], currentTime: int) -> None:
+    """ Auxiliary function that handles ECHO command
+
+    Args:
+        arguments (list[bytes]): list of arguments
+        replies (list[bytes]): replies to send back to connection that sent command
+        currentTime (int): monotonic time in nanoseconds at which the command was received
+    """
+    outgoingMessage = b''.join(arguments)
+    appendReply(outgoingMessage, replies)
+
+
+def setCommand(arguments: list[bytes], replies: list[bytes], currentTime: int) -> None:
+    """ Auxiliary function that handles SET command
+
+    Args:
+        arguments (list[bytes]): list of arguments
+        replies (list[bytes]): replies to send back to connection that sent command
+        currentTime (int): monotonic time in nanoseconds at which the command was received
+    """
+    # Separating arguments
+    key = arguments[0]
+    value = arguments[1]
+
+    # Options are positional, SET key value [PX milliseconds]
+    if len(arguments) >= 4 and arguments[2] in PX_OPTIONS:
+        expirationTime = getExpirationTime(arguments[3], currentTime)
+        heapq.heappush(EXPIRY_HEAP, (expirationTime, key))
+    else:
+        expirationTime = None
+
+    # Commands run one at a time on the event loop, so no locking is needed.
+    KEY_VALUE_STORE[key] = (value, expirationTime)
+
+    # Once we are done, we send back OK.
+    appendReply(b"OK", replies)
+
+
+def getCommand(arguments: list[bytes], replies: list[bytes], currentTime: int) -> None:
+    """ Auxiliary function that handles GET command
+
+    Args:
+        arguments (list[bytes]): list of arguments
+        replies (list[bytes]): replies to send back to connection that sent command
+        currentTime (int): monotonic time in nanoseconds at which the command was received
+    """
+    key = arguments[0]
+
+    # Querying KEY_VALUE_STORE for requested value
+    entry = KEY_VALUE_STORE.get(key)
+
+    if entry is None:
+        # Sending back (nil) because key does not exist
+        outgoingMessage = None
+    else:
+        value, expirationTime = entry
+
+        if expirationTime is not None and currentTime >= expirationTime:
+            # Key is expired, so remove it and send back (nil)
+            del KEY_VALUE_STORE[key]
+            outgoingMessage = None
+        else:
+            outgoingMessage = value
+
+    # Sending message
+    appendReply(outgoingMessage, replies)
+
+
+# Maps command names to the function that handles them
+COMMAND_HANDLERS: dict[bytes, Callable[[list[bytes], list[bytes], int], None]] = {
+    b"ping": pingCommand,
+    b"echo": echoCommand,
+    b"set": setCommand,
+    b"get": getCommand,
+}
+
+
+# ========== #
+#  Handlers   #  
+def appendReply(message: bytes | None, replies: list[bytes]) -> None:
+    """ Formats message and appends it to the replies to send back to connection.
+    A message of None is sent back as (nil).
+
+    Args:
+        message (bytes | None): raw reply, already encoded
+        replies (list[bytes]): replies to send back to connection
+    """
+    if message is None:
+        replies.append(NIL_RESPONSE)
+        return
+
+    # Common replies skip formatting entirely
+    outgoingMessage = CANNED_RESPONSES.get(message)
+    if outgoingMessage is not None:
+        replies.append(outgoingMessage)
+        return
+
+    # The message is appended as is rather than joined, so its bytes are not copied into a new reply
+    replies.extend((SIMPLE_STRING_PREFIX, message, CRLF))
+
+
+def appendError(message: bytes, replies: list[bytes]) -> None:
+    """ Formats an error message and appends it to the replies to send back to connection.
+
+    Args:
+        message (bytes): error description, already encoded
+        replies (list[bytes]): replies to send back to connection
+    """
+    replies.extend((ERROR_PREFIX, message, CRLF))
+
+
+
+def executeCommand(parsedMessage: object, replies: list[bytes], currentTime: int) -> None:
+    """ Passes a parsed message to the correct command function.
+
+    Args:
+        parsedMessage (object): command parsed by parse()
+        replies (list[bytes]): replies to send back to connection
+        currentTime (int): monotonic time in nanoseconds at which the command was received
+    """
+    if not isinstance(parsedMessage, list):
+        parsedMessage = [parsedMessage]
+
+    if not parsedMessage:
+        # There is no command to run
+        return
+
+    if not all(isinstance(element, bytes) for element in parsedMessage):
+        # Nil and nested elements are not valid commands or arguments
+        appendError(b"invalid command, expected an array of strings", replies)
+        return
+
+    # parsedMessage is a command followed by its arguments, all kept as raw bytes
+    command = cast(bytes, parsedMessage[0])
+    args = cast(list[bytes], parsedMessage[1:])
+
+    handler = COMMAND_HANDLERS.get(command)
+    if handler is None:
+        appendReply(b'', replies)
+        return
+
+    # Bad arguments become an error reply, so the connection and the rest of the batch keep going
+    repliesCount = len(replies)
+    try:
+        handler(args, replies, currentTime)
+    except IndexError:
+        del replies[repliesCount:]
+        appendError(b"wrong number of arguments for '" + command + b"' command", replies)
+    except ValueError:
+        del replies[repliesCount:]
+        appendError(b"value is not an integer or out of range", replies)
+    except TypeError:
+        del replies[repliesCount:]
+        appendError(b"invalid argument type", replies)
+
+
+def executeCommands(parsedMessages: list[object], replies: list[bytes], currentTime: int) -> None:
+    """ Passes every parsed message from a single read to the correct command function.
+    Never raises, so the replies of commands that already ran are always sent back.
+
+    Args:
+        parsedMessages (list[object]): commands parsed by parseAll()
+        replies (list[bytes]): replies to send back to connection
+        currentTime (int): monotonic time in nanoseconds at which the commands were received
+    """
+    for parsedMessage in parsedMessages:
+        repliesCount = len(replies)
+        try:
+            executeCommand(parsedMessage, replies, currentTime)
+        except Exception:
+            # Unexpected failure, dropping any partial reply of this command and answering with an error instead
+            del replies[repliesCount:]
+            appendError(b"internal error while executing command", replies)
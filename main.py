@@ -1,355 +1,114 @@
 ############
-# This is my implementation of Redis without an event loop.
+# This is my implementation of Redis with an asyncio event loop.
 # You can find more info in the README file.
 ############
 
-import socket
-import threading
-import re
+import asyncio
 import time
 
-# ========== #
-#  Globals   #
-STD_RESPONSE = 'PONG'
-KEY_VALUE_STORE, KEY_EXPIRY_STORE = {}, {}
-KEY_VALUE_STORE_LOCKS = {}
-KEY_VALUE_STORE_LOCKS_LOCK = threading.Lock()
+from fastpath import PROTOCOL_ERROR, executeCommands, parseAll, removeExpiredKeys
 
 # ========== #
-#  Parsers   #
-def simpleStringParser(message: str) -> list:
-    """ Parses Redis Protocol simple strings. 
-    Returns empty string if message is not properly formatted
-
-    Args:
-        message (str): raw message string received from client
-
-    Returns:
-        str: decoded string
-    """
-    if len(message) < 4:
-        return ''
-
-    finalString, index = '', 1
-    while message[index].isdigit() or message[index] == '-':
-        finalString += message[index]
-        index += 1
-
-    return [finalString]
-
-def bulkStringParser(message: str) -> list:
-    """ Parses Redis Protocol bulk strings. 
-    Returns empty string if message is not properly formatted
-
-    Args:
-        message (str): raw message string received from client
-
-    Returns:
-        str: decoded string
-    """
-    if len(message) <= 1:
-        return ['']
-    
-    # Finding message length
-    index = 1
-    lengthOfMessage = ''
-
-    while message[index].isdigit() or message[index] == '-':
-        lengthOfMessage += message[index]
-        index += 1
-
-    # Checking that bulk string is the appropriate length
-    if len(message) != (6 + int(lengthOfMessage)):
-        return ['']
-    
-    # Skipping escaped characters and reading in message
-    index += 2
-    finalString = message[index:index + int(lengthOfMessage)]
-    
-    return [finalString]
-
-def arrayParser(message: str) -> list:
-    """ Parses Redis Protocol arrays. 
-    Returns empty string if message is not properly formatted. 
-    Does not support arrays of arrays.
-
-    Args:
-        message (str): raw message string received from client
-
-    Returns:
-        str: decoded string
-    """
-    if len(message) < 4:
-        return ['']
-
-    # Finding array element count
-    index = 1
-    count = ''
-    while message[index].isdigit() or message[index] == '-':
-        count += message[index]
-        index += 1
-
-    index += 2
-
-    elementsString = message[index:]
-    elementsStrings = [s for s in re.split(re.escape('\r\n'),elementsString) if s != '']
-    
-    if len(elementsStrings) != 2 * int(count):
-        return ['']
-
-    results = []
-    elemIdx = 0 
-    while elemIdx < len(elementsStrings)-1:
-        match elementsStrings[elemIdx][0]:
-            case '+':
-                processedString = elementsStrings[elemIdx][1:]
-            case '$':
-                processedString = elementsStrings[elemIdx + 1]
-            case _:
-                processedString = ''
-        
-        elemIdx += 2
-        results.append(processedString)
-    
-    return results
-
-def messageParser(message: str) -> str:
-    """ Parses a message and passes it on to its appropriate sub-parser.
-
-    Args:
-        message (str): encoded message received from connection
-
-    Returns:
-        str: decoded message
-    """
-    rawString = message.decode('utf-8')
-
-    match rawString[0]:
-        case '+':
-            processedString = simpleStringParser(rawString)
-        case '$':
-            processedString = bulkStringParser(rawString)
-        case '*':
-            processedString = arrayParser(rawString)
-        case _:
-            processedString = ''
-        
-    return processedString
-
-# ================== #
-#  Expiry Functions  #
-def setExpiry(key: str, arguments: list[str]):
-    """ Helper functions that sets an expiry if needed for a key. 
-    Only to be called from inside set().
-
-    Args:
-        key (str): key of value with given expiry
-        arguments (list[str]): list of arguments
-    """
-    # Get current time in milliseconds and time limit
-    currentTime = time.time() * 1000
-    timeLimit = int(arguments[0])
-
-    # Set expiration time
-    expirationTime = currentTime + timeLimit
-
-    # Store
-    KEY_EXPIRY_STORE[key] = expirationTime
-
-def checkExpiry(key: str) -> bool:
-    """ Helper functions that checks if the key is expired, if so it removes the key_value pair from store. 
-    Only to be called from inside get().
-
-    Args:
-        key (str): key of value with given expiry
-    
-    Returns:
-        bool: boolean indicating whether key is expired
-    """
-    # Get current time in milliseconds
-    currentTime = time.time() * 1000
+#  Globals   #
+EXPIRY_CHECK_INTERVAL = 0.1
 
-    # Check whether key has expiry and whether current time is after expiry time
-    if key in KEY_EXPIRY_STORE and currentTime >= KEY_EXPIRY_STORE[key]:
-        # Key is expired, so remove all data on key
-        KEY_EXPIRY_STORE.pop(key)
-        KEY_VALUE_STORE.pop(key)
-        
-        return True
-    
-    return False
+# Bytes read from a connection at a time, and the most a connection may buffer for a single incomplete command
+READ_SIZE = 4096
+MAX_BUFFER_SIZE = 64 * 1024 * 1024
+TOO_BIG_RESPONSE = b'-ERR Protocol error: too big request\r\n'
+MALFORMED_RESPONSE = b'-ERR Protocol error: malformed request\r\n'
 
-    
 # ========== #
-#  Commands  #
-def echo(arguments: list[str], connection: socket):
-    """ Auxiliary function that handles ECHO command
-
-    Args:
-        arguments (list[str]): list of arguments
-        connection (socket): socket pointing to connection that sent command
-    """
-    outgoingMessage = ''.join(arguments) 
-    sendMessage(outgoingMessage, connection)
-
-
-def set(arguments: list[str], connection: socket):
-    """ Auxiliary function that handles SET command
+#  Handlers   #  
+async def receiveMessage(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, buffer: bytearray, needed: int) -> int | None:
+    """ Receives data, appends it to the bytes left over from previous reads and executes every complete command in it.
+    A command split across reads stays in the buffer, and is only parsed again once enough bytes have arrived to complete it.
 
     Args:
-        arguments (list[str]): list of arguments
-        connection (socket): socket pointing to connection that sent command
-    """
-    # Separating arguments
-    key = arguments[0]
-    value = arguments[1]
-
-    if "px" in arguments:
-        hasExpiry = True
-        expiryArguments = arguments[arguments.index("px") + 1:]
-    else:
-        hasExpiry = False
-
-    # Checking if key is already in store,
-    #  we lock to make sure no other threads can add the key after our check.
-    KEY_VALUE_STORE_LOCKS_LOCK.acquire()
+        reader (asyncio.StreamReader): stream reader that points to connection
+        writer (asyncio.StreamWriter): stream writer that points to connection
+        buffer (bytearray): bytes left over from previous reads, updated in place
+        needed (int): length the buffer has to reach before parsing it again can make progress
 
-    if key not in KEY_VALUE_STORE_LOCKS:
-        KEY_VALUE_STORE_LOCKS[key] = threading.Lock()
-
-    KEY_VALUE_STORE_LOCKS_LOCK.release()
-
-    # Updating/Adding key-value pair to KEY_VALUE_STORE
-    KEY_VALUE_STORE_LOCKS[key].acquire()
-
-    KEY_VALUE_STORE[key] =  value
-    if hasExpiry:
-        setExpiry(key, expiryArguments)
-
-    KEY_VALUE_STORE_LOCKS[key].release()
-
-    # Once we are done, we send back OK.
-    sendMessage("OK", connection)
-
-
-def get(arguments: list[str], connection: socket):
-    """ Auxiliary function that handles GET command
-
-    Args:
-        arguments (list[str]): list of arguments
-        connection (socket): socket pointing to connection that sent command
+    Returns:
+        int | None: length the buffer has to reach before the next parse, or None if the connection was closed
     """
-    key = arguments[0]
-
-    # Checking if key is stored
-    KEY_VALUE_STORE_LOCKS_LOCK.acquire()
-
-    if key not in KEY_VALUE_STORE_LOCKS:
-        KEY_VALUE_STORE_LOCKS_LOCK.release()
-
-        # Sending back (nil) because key does not exist
-        outgoingMessage = "(nil)"
-        sendMessage(outgoingMessage, connection)
-        return
-    
-    KEY_VALUE_STORE_LOCKS_LOCK.release()
-
-    # Querying KEY_VALUE_STORE for requested value
-    KEY_VALUE_STORE_LOCKS[key].acquire()
-
-    if checkExpiry(key):
-        isExpired = True
-        outgoingMessage = "(nil)"
-    else:
-        isExpired = False
-        outgoingMessage = KEY_VALUE_STORE[key]
-
-    KEY_VALUE_STORE_LOCKS[key].release()
-    
-    if isExpired:
-        KEY_VALUE_STORE_LOCKS.pop(key)
-
-    # Sending message
-    sendMessage(outgoingMessage, connection)
-
-
-# ========== #
-#  Handlers   #  
-def sendMessage(message: str, connection: socket):
-    """ Formats message and sends it back to connection.
+    incomingMessage = await reader.read(READ_SIZE)
+    if not incomingMessage:
+        # Client closed the connection
+        return None
+
+    buffer += incomingMessage
+    if len(buffer) < needed:
+        # The pending command is still incomplete, so there is no point in parsing it again
+        return needed
+
+    # Parsing and executing every complete command as one batch, pipelined commands arrive in the same read
+    parsedMessages, consumed, needed = parseAll(buffer, needed > 0)
+    del buffer[:consumed]
+
+    replies: list[bytes] = []
+    executeCommands(parsedMessages, replies, time.monotonic_ns())
+
+    # After answering the commands before it, we give up on the connection if the pending command
+    # is malformed (we cannot tell where the next command starts) or too big to ever be buffered
+    isClosing = needed == PROTOCOL_ERROR or needed > MAX_BUFFER_SIZE
+    if needed == PROTOCOL_ERROR:
+        replies.append(MALFORMED_RESPONSE)
+    elif needed > MAX_BUFFER_SIZE:
+        replies.append(TOO_BIG_RESPONSE)
+
+    # Sending every reply for this read at once, then waiting until they are flushed so the socket never backs up.
+    # writelines lets the transport gather the replies with a single sendmsg where available (Python 3.12+).
+    if replies:
+        writer.writelines(replies)
+        await writer.drain()
+    return None if isClosing else needed
+
+
+async def connectionWorker(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """ Serves as the coroutine for each connection.
 
     Args:
-        message (str): Parsed string
-        connection (socket): socket object that points to connection
+        reader (asyncio.StreamReader): stream reader that points to connection
+        writer (asyncio.StreamWriter): stream writer that points to connection
     """
-    if message == "(nil)":
-        outgoingMessage = "$-1\r\n"
-    else:
-        outgoingMessage = '+' + message + '\r\n'
-
-    connection.send(outgoingMessage.encode('utf-8'))
-
-
-
-def receiveMessage(connection):
-    """ Receives a message passes it on to a parser and then passes parsed message to correct command function.
-
-    Args:
-        connection (socket): socket object that points to connection
+    buffer = bytearray()
+    needed: int | None = 0
+    try:
+        while needed is not None:
+            needed = await receiveMessage(reader, writer, buffer, needed)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def expiryWorker() -> None:
+    """ Periodically removes expired keys, so keys that are never queried again do not stay in memory.
     """
-    incomingMessage = connection.recv(4096)
-    decodedMessage = messageParser(incomingMessage)
-
-    if len(decodedMessage) > 1:
-        # decodedMessage is a command with arguments
-        command = decodedMessage[0]
-        args = decodedMessage[1:]
-        
-        match command:
-            case "echo":
-                echo(args, connection)
-            case "set":
-                set(args, connection)     
-            case "get":
-                get(args, connection)  
-            case _:
-                sendMessage('', connection)
-    else:
-        # Decoded message is a single string
-        if decodedMessage[0] == 'ping':
-            outgoingMessage = STD_RESPONSE
-            sendMessage(outgoingMessage, connection)
+    while True:
+        await asyncio.sleep(EXPIRY_CHECK_INTERVAL)
 
+        while removeExpiredKeys(time.monotonic_ns()):
+            # More keys expired than one call removes, so we let connections run and continue right away
+            await asyncio.sleep(0)
 
-def connectionWorker(connection: socket) -> None:
-    """ Serves as worker thread for each connection.
 
-    Args:
-        connection (socket): socket object that points to connection
-    """
-    with connection:
-        while True:
-            receiveMessage(connection)
-
-
-def main():
+async def main() -> None:
     print("Starting...")
 
-    # Creating Server
-    server_socket = socket.create_server(("localhost", 6379), reuse_port=True)
+    # Starting background expiry of keys, the reference keeps the task from being garbage collected
+    expiryTask = asyncio.create_task(expiryWorker())
+
+    # Creating Server, every connection is served by connectionWorker on the event loop
+    server = await asyncio.start_server(connectionWorker, "localhost", 6379, reuse_port=True)
 
     # Listening for connections
-    with server_socket:
-        while True:
-            # Wait for connection
-            connection, address = server_socket.accept()
+    async with server:
+        await server.serve_forever()
 
-            # Start worker thread to listen and return messages
-            newThread = threading.Thread(target=connectionWorker, args=[connection])
-            newThread.start()
-            
 
-    
 if __name__ == "__main__":
     # main() works as the listener for connections.
-    main()
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+############
+# Tests for the parser, the incremental buffering in receiveMessage() and the command batch.
+# Run with: python -m unittest
+############
+
+import asyncio
+import unittest
+
+import fastpath
+import main
+from fastpath import PROTOCOL_ERROR, executeCommands, parseAll
+
+
+def encodeCommand(*arguments: bytes) -> bytes:
+    """ Encodes a command as a Redis Protocol array of bulk strings, the way clients send it.
+    """
+    return b"*%d\r\n" % len(arguments) + b"".join(b"$%d\r\n%s\r\n" % (len(argument), argument) for argument in arguments)
+
+
+def feedChunks(chunks: list[bytes]) -> list[object]:
+    """ Feeds chunks through parseAll() the way receiveMessage() does, and returns every parsed message.
+    """
+    buffer, needed, messages = bytearray(), 0, []
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < needed:
+            continue
+
+        parsedMessages, consumed, needed = parseAll(buffer, needed > 0)
+        assert needed != PROTOCOL_ERROR
+        del buffer[:consumed]
+        messages.extend(parsedMessages)
+
+    assert not buffer
+    return messages
+
+
+class FakeWriter:
+    """ Collects what receiveMessage() writes instead of sending it to a socket.
+    """
+    def __init__(self) -> None:
+        self.written = b""
+
+    def write(self, data: bytes) -> None:
+        self.written += data
+
+    def writelines(self, data: list[bytes]) -> None:
+        self.written += b"".join(data)
+
+    async def drain(self) -> None:
+        pass
+
+
+def receive(data: bytes) -> tuple[int | None, bytes]:
+    """ Runs receiveMessage() once on data, and returns its result and what it wrote back.
+    """
+    async def run() -> tuple[int | None, bytes]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        writer = FakeWriter()
+        needed = await main.receiveMessage(reader, writer, bytearray(), 0)  # type: ignore[arg-type]
+        return needed, writer.written
+
+    return asyncio.run(run())
+
+
+class ParseAllTest(unittest.TestCase):
+    def test_frame_split_at_every_offset(self) -> None:
+        frame = encodeCommand(b"set", b"key", b"value", b"px", b"100")
+        for offset in range(1, len(frame)):
+            self.assertEqual(feedChunks([frame[:offset], frame[offset:]]), [[b"set", b"key", b"value", b"px", b"100"]])
+
+    def test_frame_fed_byte_by_byte(self) -> None:
+        frame = encodeCommand(b"echo", b"hello") + encodeCommand(b"ping")
+        self.assertEqual(feedChunks([frame[i:i + 1] for i in range(len(frame))]), [[b"echo", b"hello"], [b"ping"]])
+
+    def test_pipelined_frames(self) -> None:
+        frames = encodeCommand(b"set", b"a", b"1") + encodeCommand(b"get", b"a") + encodeCommand(b"ping")
+        self.assertEqual(parseAll(frames), ([[b"set", b"a", b"1"], [b"get", b"a"], [b"ping"]], len(frames), 0))
+
+    def test_pipelined_frames_with_incomplete_tail(self) -> None:
+        frames = encodeCommand(b"ping") + encodeCommand(b"echo", b"hello")[:10]
+        self.assertEqual(parseAll(frames), ([[b"ping"]], len(encodeCommand(b"ping")), 14))
+
+    def test_needed_for_incomplete_header(self) -> None:
+        # Without a CRLF any new byte may complete the header
+        self.assertEqual(parseAll(b"*2\r"), ([], 0, 4))
+        self.assertEqual(parseAll(b"*1\r\n$3"), ([], 0, 7))
+
+    def test_needed_for_incomplete_body(self) -> None:
+        # The whole bulk string and its CRLF have to arrive
+        self.assertEqual(parseAll(b"$5\r\nhe"), ([], 0, 11))
+        self.assertEqual(parseAll(b"*1\r\n$5\r\nhe"), ([], 0, 15))
+        self.assertEqual(parseAll(b"*1\r\n$5\r\nhe", True), ([], 0, 15))
+
+    def test_malformed_tail_after_valid_commands(self) -> None:
+        frames = encodeCommand(b"ping") + encodeCommand(b"get", b"a")
+        self.assertEqual(parseAll(frames + b"?junk\r\n"), ([[b"ping"], [b"get", b"a"]], len(frames) + 7, PROTOCOL_ERROR))
+        self.assertEqual(parseAll(frames + b"$3\r\nabcd\r\n")[2], PROTOCOL_ERROR)
+
+    def test_malformed_lengths(self) -> None:
+        for header in (b"$1_0", b"$ 3", b"$3 ", b"$+3", b"$", b"$-", b"$0x3", b"*+1", b"*1_0", b"* 1", b"*"):
+            with self.subTest(header=header):
+                self.assertEqual(parseAll(header + b"\r\n0123456789\r\n"), ([], 14 + len(header), PROTOCOL_ERROR))
+        self.assertEqual(parseAll(b"$1_0\r\n0123456789\r\n", True)[2], PROTOCOL_ERROR)
+
+    def test_nil_lengths(self) -> None:
+        self.assertEqual(parseAll(b"$-1\r\n*-1\r\n"), ([None, None], 10, 0))
+
+    def test_header_line_too_long(self) -> None:
+        self.assertEqual(parseAll(b"+" + b"a" * fastpath.MAX_LINE_LENGTH)[2], PROTOCOL_ERROR)
+
+    def test_too_many_array_elements(self) -> None:
+        self.assertEqual(parseAll(b"*%d\r\n" % (fastpath.MAX_ARRAY_LENGTH + 1))[2], PROTOCOL_ERROR)
+
+    def test_deep_nesting(self) -> None:
+        nested = b"*1\r\n" * 200_000
+        self.assertEqual(parseAll(encodeCommand(b"ping") + nested)[0], [[b"ping"]])
+        self.assertEqual(parseAll(encodeCommand(b"ping") + nested)[2], PROTOCOL_ERROR)
+        self.assertEqual(parseAll(nested, True)[2], PROTOCOL_ERROR)
+
+
+class ReceiveMessageTest(unittest.TestCase):
+    def setUp(self) -> None:
+        fastpath.KEY_VALUE_STORE.clear()
+        fastpath.EXPIRY_HEAP.clear()
+
+    def test_pipelined_replies(self) -> None:
+        needed, written = receive(encodeCommand(b"set", b"a", b"1") + encodeCommand(b"get", b"a") + encodeCommand(b"ping"))
+        self.assertEqual(needed, 0)
+        self.assertEqual(written, b"+OK\r\n+1\r\n+PONG\r\n")
+
+    def test_too_big_request(self) -> None:
+        needed, written = receive(encodeCommand(b"ping") + b"*2\r\n$3\r\nget\r\n$%d\r\n" % main.MAX_BUFFER_SIZE)
+        self.assertIsNone(needed)
+        self.assertEqual(written, b"+PONG\r\n" + main.TOO_BIG_RESPONSE)
+
+    def test_malformed_request(self) -> None:
+        needed, written = receive(encodeCommand(b"ping") + b"*1\r\n" * 1000)
+        self.assertIsNone(needed)
+        self.assertEqual(written, b"+PONG\r\n" + main.MALFORMED_RESPONSE)
+
+
+class ExecuteCommandsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        fastpath.KEY_VALUE_STORE.clear()
+        fastpath.EXPIRY_HEAP.clear()
+
+    def test_bad_command_does_not_drop_batch(self) -> None:
+        replies: list[bytes] = []
+        executeCommands([[b"set", b"q", b"v"], [b"get"], [b"set", b"k", b"v", b"px", b"abc"], [b"echo", None], [b"ping"]], replies, 0)
+        self.assertEqual(b"".join(replies), b"+OK\r\n"
+                         b"-ERR wrong number of arguments for 'get' command\r\n"
+                         b"-ERR value is not an integer or out of range\r\n"
+                         b"-ERR invalid command, expected an array of strings\r\n"
+                         b"+PONG\r\n")
+        self.assertEqual(fastpath.KEY_VALUE_STORE, {b"q": (b"v", None)})
+
+
+if __name__ == "__main__":
+    unittest.main()